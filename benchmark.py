@@ -0,0 +1,536 @@
+"""
+Offline replay benchmarks for the refresh and query path of myapp.py.
+
+Nothing here touches the network or the real Supabase project: Coveo responses are
+replayed from bench_fixtures/coveo (or synthesised from products.csv when nothing has
+been recorded) and Supabase is replaced by an in-memory stand-in.
+
+    python benchmark.py                         # 1k and 10k products
+    python benchmark.py --sizes 1000 100000 1000000
+    python benchmark.py --compare <commit>      # compare against a stored run
+    python benchmark.py --record                # capture real Coveo pages once (network)
+
+Results are written to bench_results/<commit>.json so runs can be compared across commits.
+"""
+import argparse
+import atexit
+import copy
+import csv
+import heapq
+import io
+import itertools
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from types import SimpleNamespace
+from unittest import mock
+
+import requests
+import streamlit as st
+import supabase as supabase_package
+from PIL import Image
+from streamlit.testing.v1 import AppTest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(HERE, "bench_fixtures", "coveo")
+RESULTS_DIR = os.path.join(HERE, "bench_results")
+SCRATCH_DIR = tempfile.mkdtemp(prefix="lcbo-bench-")  # Image cache and snapshot used by the app under test
+atexit.register(shutil.rmtree, SCRATCH_DIR, ignore_errors=True)
+COVEO_PAGE_SIZE = 500
+
+BENCH_SECRETS = {
+    "supabase": {"url": "http://localhost", "key": "benchmark"},
+    "smtp": {"username": "benchmark", "password": "benchmark"},
+    "correct_pin": "0000",
+}
+
+# Primary keys used by the stand-in to emulate upsert conflicts
+TABLE_KEYS = {
+    "Products": ("uri", "Date"),
+    "Favourites": ("URI", "User ID"),
+    "Price History": ("URI", "Date"),
+}
+
+
+# -------------------------------
+# In-memory Supabase stand-in
+# -------------------------------
+class FakeQuery:
+    """The subset of the supabase-py query builder used by myapp.py."""
+
+    def __init__(self, client, table_name):
+        self._client = client
+        self._table_name = table_name
+        self._columns = None
+        self._filters = []
+        self._lower_bounds = []
+        self._orders = []
+        self._limit = None
+        self._range = None
+        self._upsert = None
+        self._delete = False
+
+    def select(self, columns="*"):
+        self._columns = None if columns == "*" else [c.strip() for c in columns.split(",")]
+        return self
+
+    def eq(self, column, value):
+        self._filters.append((column, value))
+        return self
+
+    def gte(self, column, value):
+        self._lower_bounds.append((column, value))
+        return self
+
+    def order(self, column, desc=False):
+        self._orders.append((column, desc))
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    def range(self, start, end):
+        self._range = (start, end)
+        return self
+
+    def upsert(self, record):
+        self._upsert = record
+        return self
+
+    def delete(self):
+        self._delete = True
+        return self
+
+    def _matches(self, row):
+        return (all(row.get(column) == value for column, value in self._filters)
+                and all(row.get(column) is not None and row.get(column) >= value for column, value in self._lower_bounds))
+
+    def execute(self):
+        with self._client.lock:
+            rows = self._client.tables.setdefault(self._table_name, {})
+            if self._upsert is not None:
+                records = self._upsert if isinstance(self._upsert, list) else [self._upsert]
+                for record in records:
+                    rows[self._client.key_for(self._table_name, record)] = dict(record)
+                return SimpleNamespace(data=[dict(r) for r in records])
+            if self._delete:
+                deleted = [key for key, row in rows.items() if self._matches(row)]
+                data = [rows.pop(key) for key in deleted]
+                return SimpleNamespace(data=data)
+            data = [row for row in rows.values() if self._matches(row)]
+        if len(self._orders) == 1 and self._limit is not None:
+            column, desc = self._orders[0]
+            pick = heapq.nlargest if desc else heapq.nsmallest
+            data = pick(self._limit, data, key=lambda r: r.get(column) or "")
+        else:
+            # Stable sorts from the last key to the first give a multi-column order
+            for column, desc in reversed(self._orders):
+                data = sorted(data, key=lambda r: r.get(column) or "", reverse=desc)
+        if self._range is not None:
+            data = data[self._range[0]:self._range[1] + 1]
+        if self._limit is not None:
+            data = data[:self._limit]
+        if self._columns:
+            data = [{c: row.get(c) for c in self._columns} for row in data]
+        else:
+            data = [dict(row) for row in data]
+        return SimpleNamespace(data=data)
+
+
+class FakeSupabaseClient:
+    """Stands in for supabase.Client; tables are dicts keyed by TABLE_KEYS."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tables = {}
+        self._autoincrement = itertools.count()
+
+    def key_for(self, table_name, record):
+        columns = TABLE_KEYS.get(table_name)
+        if not columns:
+            return next(self._autoincrement)
+        return tuple(record.get(c) for c in columns)
+
+    def table(self, table_name):
+        return FakeQuery(self, table_name)
+
+    def reset(self):
+        with self.lock:
+            self.tables = {}
+
+    def seed(self, table_name, records):
+        with self.lock:
+            rows = self.tables.setdefault(table_name, {})
+            for record in records:
+                rows[self.key_for(table_name, record)] = record
+
+
+FAKE_SUPABASE = FakeSupabaseClient()
+
+
+# -------------------------------
+# Coveo replay
+# -------------------------------
+def load_seed_items():
+    """Recorded Coveo results if present, otherwise results rebuilt from products.csv."""
+    if os.path.isdir(FIXTURES_DIR):
+        items = []
+        for name in sorted(os.listdir(FIXTURES_DIR)):
+            if name.endswith(".json"):
+                with open(os.path.join(FIXTURES_DIR, name)) as file:
+                    items.extend(json.load(file).get("results", []))
+        if items:
+            return items
+
+    items = []
+    with open(os.path.join(HERE, "products.csv"), newline="", encoding="utf-8-sig") as file:
+        for row in csv.DictReader(file):
+            raw = {key[len("raw_"):]: value for key, value in row.items() if key.startswith("raw_")}
+            raw["stores_inventory"] = row.get("stores_inventory", 0)
+            items.append({"title": row["title"], "uri": row["uri"], "raw": raw})
+    return items
+
+
+def synthesise_catalogue(seed_items, size, rng):
+    """Scale the seed items to `size` products with unique URIs and jittered prices/ratings."""
+    items = []
+    for i in range(size):
+        base = seed_items[i % len(seed_items)]
+        if i < len(seed_items):
+            items.append(base)
+            continue
+        item = copy.deepcopy(base)
+        item["uri"] = f"{base['uri']}-bench{i}"
+        item["title"] = f"{base['title']} #{i}"
+        raw = item["raw"]
+        try:
+            raw["ec_price"] = round(float(raw.get("ec_price")) * rng.uniform(0.7, 1.5), 2)
+        except (TypeError, ValueError):
+            pass
+        raw["ec_rating"] = round(rng.uniform(4.0, 5.0), 1)
+        raw["avg_reviews"] = rng.randint(0, 500)
+        items.append(item)
+    return items
+
+
+class CoveoReplay:
+    """Replaces requests.post, paging through a fixed catalogue like the Coveo search API."""
+
+    def __init__(self, items):
+        self.items = items
+
+    def __call__(self, url, headers=None, json=None, **kwargs):
+        first = json.get("firstResult", 0)
+        count = json.get("numberOfResults", COVEO_PAGE_SIZE)
+        body = {"totalCount": len(self.items), "results": self.items[first:first + count]}
+        return ReplayResponse(body)
+
+
+class ReplayResponse:
+    def __init__(self, body):
+        self._body = body
+        self._content = None
+
+    @property
+    def content(self):
+        if self._content is None:
+            self._content = json.dumps(self._body).encode()
+        return self._content
+
+    def json(self):
+        return self._body
+
+
+class ImageReplay:
+    """Replaces requests.get for product images with one generated 1280px PNG."""
+
+    def __init__(self):
+        buffer = io.BytesIO()
+        Image.new("RGB", (1280, 1280), (120, 20, 40)).save(buffer, "PNG")
+        self.content = buffer.getvalue()
+
+    def __call__(self, url, **kwargs):
+        return SimpleNamespace(content=self.content, raise_for_status=lambda: None)
+
+
+def record_coveo_pages(myapp):
+    """Run refresh_data against the real Coveo API, saving every page it receives."""
+    os.makedirs(FIXTURES_DIR, exist_ok=True)
+    real_post = requests.post
+    pages = itertools.count()
+
+    def recording_post(*args, **kwargs):
+        response = real_post(*args, **kwargs)
+        with open(os.path.join(FIXTURES_DIR, f"page_{next(pages):04d}.json"), "w") as file:
+            json.dump(response.json(), file)
+        return response
+
+    with mock.patch.object(requests, "post", recording_post), mock.patch.object(myapp, "send_email_with_lowest_promo_prices", lambda items: None):
+        run_and_join(myapp.refresh_data)
+    print(f"Recorded {next(pages)} Coveo pages to {FIXTURES_DIR}")
+
+
+# -------------------------------
+# Harness helpers
+# -------------------------------
+def import_myapp():
+    """Import myapp.py with benchmark secrets, the in-memory Supabase client and throwaway on-disk caches."""
+    # The app's own cache directories must never see the replayed placeholder data
+    os.environ["LCBO_IMAGE_CACHE_DIR"] = os.path.join(SCRATCH_DIR, "image_cache")
+    os.environ["LCBO_SNAPSHOT_PATH"] = os.path.join(SCRATCH_DIR, "snapshot", "products.pkl")
+    st.secrets = BENCH_SECRETS
+    supabase_package.create_client = lambda url, key: FAKE_SUPABASE
+    # Image jobs run on the app's worker pool and can outlive any single benchmark, so the
+    # replay stays installed for the whole process rather than inside a with-block
+    requests.get = ImageReplay()
+    sys.path.insert(0, HERE)
+    import myapp
+    return myapp
+
+
+def reset_app_state():
+    """Start a catalogue size from a true cold state: no shared resources, snapshot or cached images."""
+    st.cache_resource.clear()
+    for name in os.listdir(SCRATCH_DIR):
+        shutil.rmtree(os.path.join(SCRATCH_DIR, name), ignore_errors=True)
+
+
+def reset_metrics(myapp):
+    metrics = myapp.get_metrics()
+    with metrics["lock"]:
+        metrics["spans"].clear()
+        metrics["counters"].clear()
+        metrics["last_errors"].clear()
+
+
+def run_and_join(func, *args, **kwargs):
+    """Call func and wait for any background threads it started."""
+    before = set(threading.enumerate())
+    result = func(*args, **kwargs)
+    for thread in set(threading.enumerate()) - before:
+        thread.join()
+    return result
+
+
+def time_call(func, repeat, *args, **kwargs):
+    """Median and best wall time of `repeat` calls, in seconds."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        samples.append(time.perf_counter() - start)
+    return {"median": statistics.median(samples), "min": min(samples)}
+
+
+def filter_combinations(data):
+    """Representative sidebar filter states, built from the most common values in the data."""
+    def top(column):
+        values = data[column].dropna()
+        values = values[values != 'N/A']
+        return values.mode().iloc[0] if not values.empty else 'N/A'
+
+    base = {'country': 'All Countries', 'region': 'All Regions', 'varietal': 'All Varietals',
+            'exclude_usa': False, 'in_stock': False, 'only_vintages': False, 'search_text': ''}
+    variants = {
+        "none": {},
+        "country": {'country': top('raw_country_of_manufacture')},
+        "region": {'region': top('raw_lcbo_region_name')},
+        "varietal": {'varietal': top('raw_lcbo_varietal_name')},
+        "exclude_usa+in_stock": {'exclude_usa': True, 'in_stock': True},
+        "vintages": {'only_vintages': True},
+        "search": {'search_text': 'cabernet'},
+        "all": {'country': top('raw_country_of_manufacture'), 'exclude_usa': True, 'in_stock': True,
+                'only_vintages': True, 'search_text': 'a'},
+    }
+    return {name: {**base, **overrides} for name, overrides in variants.items()}
+
+
+def seed_price_history(products, days, favourites_count, history_products, rng):
+    """Favourites plus one Price History row per day for the first `history_products` products."""
+    today = date.today()
+    tracked = products[:history_products]
+    FAKE_SUPABASE.seed("Favourites", [
+        {"URI": p["uri"], "Date": today.isoformat(), "User ID": "admin"} for p in tracked[:favourites_count]
+    ])
+    history = []
+    for product in tracked:
+        try:
+            price = float(product.get("raw_ec_price"))
+        except (TypeError, ValueError):
+            continue
+        for day in range(days):
+            history.append({
+                "URI": product["uri"],
+                "Title": product.get("title", "Unknown"),
+                "Date": (today - timedelta(days=day)).isoformat(),
+                "Price": round(price * rng.uniform(0.8, 1.1), 2),
+            })
+    FAKE_SUPABASE.seed("Price History", history)
+
+
+# -------------------------------
+# Benchmarks
+# -------------------------------
+def bench_refresh(myapp, items):
+    """Time refresh_data end to end plus its fetch/transform/persist spans."""
+    FAKE_SUPABASE.reset()
+    reset_metrics(myapp)
+    with mock.patch.object(requests, "post", CoveoReplay(items)), \
+            mock.patch("time.sleep", lambda seconds: None), \
+            mock.patch.object(myapp, "send_email_with_lowest_promo_prices", lambda items: None):
+        before = set(threading.enumerate())
+        start = time.perf_counter()
+        df_products = myapp.refresh_data()
+        returned = time.perf_counter() - start
+        for thread in set(threading.enumerate()) - before:
+            thread.join()
+        total = time.perf_counter() - start
+    spans = myapp.metrics_snapshot()["spans"]
+    results = {"refresh.returned": returned, "refresh.total": total}
+    for stage in ("refresh.fetch", "refresh.transform", "refresh.analytics", "refresh.persist"):
+        if stage in spans:
+            results[stage] = spans[stage]["total"]
+    return df_products, results
+
+
+def bench_queries(myapp, repeat):
+    """Time loading the latest snapshot and filter_and_sort_data across filter/sort combinations."""
+    results = {}
+    results["load_products"] = time_call(myapp.load_products_from_supabase, repeat)["median"]
+    data = myapp.load_products_from_supabase()
+    results["load_price_history"] = time_call(myapp.load_price_history, repeat)["median"]
+    price_history = myapp.load_price_history()
+    results["value_analytics"] = time_call(myapp.add_value_metrics, repeat, data, price_history)["median"]
+    data = myapp.add_value_metrics(data, price_history)
+    combos = filter_combinations(data)
+    for (name, filters), sort_by in itertools.product(combos.items(), myapp.SORT_OPTIONS):
+        timing = time_call(lambda: myapp.filter_and_sort_data(data.copy(), sort_by, **dict(filters)), repeat)
+        results[f"filter_and_sort[{name}|{sort_by}]"] = timing["median"]
+    return results
+
+
+def bench_favourites(myapp, products, history_days, favourites_count, history_products, repeat, rng):
+    """Time get_favourites_with_lowest_promo_price against synthetic price history."""
+    results = {}
+    for days in history_days:
+        with FAKE_SUPABASE.lock:
+            FAKE_SUPABASE.tables.pop("Favourites", None)
+            FAKE_SUPABASE.tables.pop("Price History", None)
+        seed_price_history(products, days, favourites_count, history_products, rng)
+        results[f"favourites_lowest_promo[{days}d]"] = time_call(myapp.get_favourites_with_lowest_promo_price, repeat)["median"]
+    return results
+
+
+def bench_rerun(repeat):
+    """Cold and warm script-run latency of main() via Streamlit's AppTest."""
+    app = AppTest.from_file(os.path.join(HERE, "myapp.py"), default_timeout=600)
+    app.secrets.update(BENCH_SECRETS)
+    start = time.perf_counter()
+    app.run()
+    results = {"rerun.cold": time.perf_counter() - start}
+    if app.exception:
+        print(f"App raised during benchmark run: {app.exception}")
+        return results
+    results["rerun.warm"] = time_call(app.run, repeat)["median"]
+    return results
+
+
+# -------------------------------
+# Result storage and comparison
+# -------------------------------
+def current_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def save_results(results, args):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    commit = current_commit()
+    path = os.path.join(RESULTS_DIR, f"{commit}.json")
+    with open(path, "w") as file:
+        json.dump({"commit": commit, "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                   "python": sys.version.split()[0], "args": vars(args), "results": results}, file, indent=2)
+    return path
+
+
+def compare_results(results, baseline_ref, threshold):
+    """Print per-metric change against a stored run; returns the number of regressions."""
+    path = baseline_ref if os.path.isfile(baseline_ref) else os.path.join(RESULTS_DIR, f"{baseline_ref}.json")
+    with open(path) as file:
+        baseline = json.load(file)
+    print(f"\nComparison against {baseline['commit']} (regression threshold {threshold:.0%})")
+    regressions = 0
+    for size, metrics in results.items():
+        for name, value in metrics.items():
+            before = baseline["results"].get(size, {}).get(name)
+            if not before:
+                continue
+            change = (value - before) / before
+            flag = "REGRESSION" if change > threshold else ""
+            regressions += bool(flag)
+            print(f"  {size:>8} {name:<60} {before:10.4f}s -> {value:10.4f}s {change:+7.1%} {flag}")
+    return regressions
+
+
+def print_results(size, metrics):
+    print(f"\n{size} products")
+    for name, value in metrics.items():
+        print(f"  {name:<60} {value:10.4f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000], help="catalogue sizes to benchmark")
+    parser.add_argument("--history-days", type=int, nargs="+", default=[30, 365, 1000])
+    parser.add_argument("--favourites", type=int, default=50, help="number of favourites to seed")
+    parser.add_argument("--history-products", type=int, default=500, help="products that get a price history")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-rerun", action="store_true", help="skip the AppTest rerun benchmark")
+    parser.add_argument("--compare", metavar="COMMIT_OR_FILE", help="stored run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative slowdown counted as a regression")
+    parser.add_argument("--record", action="store_true", help="record real Coveo pages into bench_fixtures/coveo and exit")
+    args = parser.parse_args()
+
+    myapp = import_myapp()
+    if args.record:
+        record_coveo_pages(myapp)
+        return 0
+
+    seed_items = load_seed_items()
+    results = {}
+    for size in args.sizes:
+        reset_app_state()
+        rng = random.Random(42)
+        items = synthesise_catalogue(seed_items, size, rng)
+        df_products, metrics = bench_refresh(myapp, items)
+        if df_products is None:
+            print(f"refresh_data returned no data for {size} products")
+            continue
+        metrics.update(bench_queries(myapp, args.repeat))
+        products = df_products.to_dict("records")
+        metrics.update(bench_favourites(myapp, products, args.history_days, args.favourites,
+                                        args.history_products, args.repeat, rng))
+        if not args.no_rerun:
+            metrics.update(bench_rerun(args.repeat))
+        results[str(size)] = metrics
+        print_results(size, metrics)
+
+    print(f"\nResults saved to {save_results(results, args)}")
+    if args.compare:
+        return 1 if compare_results(results, args.compare, args.threshold) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,8 @@
+import time
+IMPORT_STARTED_AT = time.perf_counter()  # Taken before the heavy imports so cold start includes them
 import streamlit as st
 import pandas as pd
-import time
-from datetime import datetime
+from datetime import datetime, timedelta
 import requests
 import re
 from supabase import create_client, Client
@@ -10,75 +11,273 @@ from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import threading
 import json
-
-# Supabase Configuration
-SUPABASE_URL = st.secrets["supabase"]["url"]
-SUPABASE_SERVICE_ROLE_KEY = st.secrets["supabase"]["key"]
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
-
-#Email
-SMTP_USER = st.secrets["smtp"]["username"]
-SMTP_PASS = st.secrets["smtp"]["password"]
+import os
+import io
+import base64
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from PIL import Image
 
 PRODUCTS_TABLE = "Products"
 FAVOURITES_TABLE = "Favourites"
+PRICE_HISTORY_TABLE = "Price History"
+
+SNAPSHOT_PATH = os.environ.get("LCBO_SNAPSHOT_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".snapshot", "products.pkl"))
+PRODUCTS_MAX_AGE_SECONDS = 300  # Serve the shared snapshot this long before reloading it in the background
+PRODUCTS_RETRY_SECONDS = 60  # Wait this long after a failed reload before trying Supabase again
+PRICE_HISTORY_DAYS = 365  # Window of Price History used for the price percentile
+PRICE_HISTORY_MAX_AGE_SECONDS = 3600  # Price History only gains rows once a day, so share it for an hour
+SUPABASE_PAGE_SIZE = 1000  # PostgREST's default max-rows; bigger unpaged selects are silently cut off
+
+# -------------------------------
+# Services
+# -------------------------------
+# Everything below is created on first use and shared across reruns and sessions,
+# so importing this module neither reads secrets nor opens connections.
+@st.cache_resource
+def get_supabase() -> Client:
+    """Supabase client, created on first use."""
+    return create_client(st.secrets["supabase"]["url"], st.secrets["supabase"]["key"])
+
+@st.cache_resource
+def get_executor():
+    """Worker pool for background loads that a rerun waits on later."""
+    return ThreadPoolExecutor(max_workers=4)
+
+@st.cache_resource
+def get_startup(_started_at):
+    """
+    Keeps the import timestamp of the first script run for the cold-start time-to-first-render
+    metric; later runs pass their own timestamp, which the cache ignores.
+    """
+    return {"started_at": _started_at, "first_render": None}
 
+# -------------------------------
+# Instrumentation
+# -------------------------------
+@st.cache_resource
+def get_metrics():
+    """Process-wide metrics registry, shared across reruns, sessions and background threads."""
+    return {"lock": threading.Lock(), "spans": {}, "counters": {}, "last_errors": {}}
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def record_span(stage, elapsed):
+    """Record one observation of elapsed seconds for the given stage."""
+    metrics = get_metrics()
+    with metrics["lock"]:
+        span = metrics["spans"].setdefault(stage, {"count": 0, "total": 0.0, "last": 0.0, "max": 0.0})
+        span["count"] += 1
+        span["total"] += elapsed
+        span["last"] = elapsed
+        span["max"] = max(span["max"], elapsed)
+
+@contextmanager
+def timed(stage):
+    """Time a block of code and record it as a span under the given stage name."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(stage, time.perf_counter() - start)
+
+def increment(name, value=1, **labels):
+    """Add value to the counter identified by name and labels."""
+    metrics = get_metrics()
+    key = (name, _label_key(labels))
+    with metrics["lock"]:
+        metrics["counters"][key] = metrics["counters"].get(key, 0) + value
+
+def record_error(source, error):
+    """Count an error instead of silently dropping it, keeping the last message per source."""
+    increment("errors_total", source=source)
+    metrics = get_metrics()
+    with metrics["lock"]:
+        metrics["last_errors"][source] = f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')} {type(error).__name__}: {error}"
+
+SUPABASE_BYTES_SAMPLE_ROWS = 20  # Rows serialised per response to estimate its size
+
+def _record_supabase_call(table_name, op, data):
+    increment("supabase_calls_total", table=table_name, op=op)
+    if data:
+        rows = len(data)
+        # Serialising whole pages just to count them costs as much as parsing them; size a spread of rows and extrapolate
+        sample = data[::max(1, rows // SUPABASE_BYTES_SAMPLE_ROWS)][:SUPABASE_BYTES_SAMPLE_ROWS]
+        estimated_bytes = len(json.dumps(sample, default=str)) * rows // len(sample)
+        increment("supabase_rows_total", rows, table=table_name, op=op)
+        increment("supabase_bytes_estimated_total", estimated_bytes, table=table_name, op=op)
+
+def metrics_snapshot():
+    """Return a JSON-serialisable copy of all spans, counters and last errors."""
+    metrics = get_metrics()
+    with metrics["lock"]:
+        spans = {stage: dict(span) for stage, span in metrics["spans"].items()}
+        counters = [
+            {"name": name, "labels": dict(labels), "value": value}
+            for (name, labels), value in sorted(metrics["counters"].items())
+        ]
+        last_errors = dict(metrics["last_errors"])
+    for span in spans.values():
+        span["mean"] = span["total"] / span["count"] if span["count"] else 0.0
+    return {"generated_at": datetime.now().isoformat(), "spans": spans, "counters": counters, "last_errors": last_errors}
+
+def _prometheus_labels(labels):
+    if not labels:
+        return ""
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels.items()) + "}"
+
+def metrics_to_prometheus(snapshot=None):
+    """Render a metrics snapshot in the Prometheus text exposition format."""
+    snapshot = snapshot or metrics_snapshot()
+    lines = [
+        "# HELP lcbo_span_seconds Time spent in each instrumented stage.",
+        "# TYPE lcbo_span_seconds summary",
+    ]
+    for stage, span in sorted(snapshot["spans"].items()):
+        labels = _prometheus_labels({"stage": stage})
+        lines.append(f"lcbo_span_seconds_sum{labels} {span['total']:.6f}")
+        lines.append(f"lcbo_span_seconds_count{labels} {span['count']}")
+    lines.append("# HELP lcbo_span_seconds_max Slowest observation of each instrumented stage.")
+    lines.append("# TYPE lcbo_span_seconds_max gauge")
+    for stage, span in sorted(snapshot["spans"].items()):
+        lines.append(f"lcbo_span_seconds_max{_prometheus_labels({'stage': stage})} {span['max']:.6f}")
+    seen = set()
+    for counter in snapshot["counters"]:
+        name = f"lcbo_{counter['name']}"
+        if name not in seen:
+            lines.append(f"# TYPE {name} counter")
+            seen.add(name)
+        lines.append(f"{name}{_prometheus_labels(counter['labels'])} {counter['value']}")
+    return "\n".join(lines) + "\n"
+
+def show_metrics_panel():
+    """Admin-only sidebar panel with stage timings, counters and exports."""
+    snapshot = metrics_snapshot()
+    with st.sidebar.expander("Performance"):
+        if snapshot["spans"]:
+            spans = pd.DataFrame.from_dict(snapshot["spans"], orient="index")[["count", "last", "mean", "max", "total"]]
+            st.dataframe(spans.sort_values("total", ascending=False).round(4))
+        else:
+            st.write("No timings recorded yet.")
+        if snapshot["counters"]:
+            st.dataframe(pd.DataFrame(
+                [{"name": c["name"], "labels": ", ".join(f"{k}={v}" for k, v in c["labels"].items()), "value": c["value"]}
+                 for c in snapshot["counters"]]
+            ))
+        for source, message in snapshot["last_errors"].items():
+            st.caption(f"Last {source} error: {message}")
+        st.download_button("Export JSON", json.dumps(snapshot, indent=2), file_name="lcbo_metrics.json", mime="application/json")
+        st.download_button("Export Prometheus", metrics_to_prometheus(snapshot), file_name="lcbo_metrics.prom", mime="text/plain")
+
+# -------------------------------
+# Supabase Helpers
+# -------------------------------
 def supabase_get_records(table_name):
     """Fetch all records from a Supabase table."""
     try:
-        response = supabase.table(table_name).select("*").execute()
+        response = get_supabase().table(table_name).select("*").execute()
+        _record_supabase_call(table_name, "select", response.data)
         return response.data  # Use the data attribute for successful responses
     except Exception as e:
+        record_error("supabase", e)
         return []  # Remove st.error message
 
 def supabase_upsert_record(table_name, record):
     """Insert or update a record in a Supabase table."""
     try:
-        response = supabase.table(table_name).upsert(record).execute()
+        response = get_supabase().table(table_name).upsert(record).execute()
+        _record_supabase_call(table_name, "upsert", response.data)
         return response.data  # Use the data attribute for successful responses
     except Exception as e:
+        record_error("supabase", e)
         return None  # Remove st.error message
 
 def supabase_delete_record(table_name, URI, user_id):
     """Delete a record from a Supabase table."""
     try:
-        query = supabase.table(table_name)
         response = (
-        supabase.table(table_name)
+        get_supabase().table(table_name)
         .delete()
         .eq("URI", URI)        # First filter
         .eq("User ID",user_id)  # Second filter
         .execute()
         )
+        _record_supabase_call(table_name, "delete", response.data)
         return response.data  # Use the data attribute for successful responses
     except Exception as e:
+        record_error("supabase", e)
         return None  # Remove st.error message
 
+def load_price_history(days=PRICE_HISTORY_DAYS):
+    """Fetch URI and Price for the last `days` of Price History, paging past the PostgREST row cap."""
+    since = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+    records = []
+    try:
+        with timed("load_price_history"):
+            while True:
+                response = (
+                    get_supabase().table(PRICE_HISTORY_TABLE)
+                    .select("URI, Price")
+                    .gte("Date", since)
+                    .order("Date")
+                    .order("URI")  # A total order keeps pages from overlapping or skipping rows
+                    .range(len(records), len(records) + SUPABASE_PAGE_SIZE - 1)
+                    .execute()
+                )
+                _record_supabase_call(PRICE_HISTORY_TABLE, "select", response.data)
+                records.extend(response.data)
+                if len(response.data) < SUPABASE_PAGE_SIZE:
+                    return records
+    except Exception as e:
+        record_error("supabase", e)
+        return []  # A partial history would skew the percentiles, so use none
+
+@st.cache_resource
+def get_price_history_cache():
+    return {"lock": threading.Lock(), "records": None, "loaded_at": 0.0}
+
+def get_price_history(max_age=PRICE_HISTORY_MAX_AGE_SECONDS):
+    """Recent price history shared across sessions, fetched from Supabase at most once per max_age."""
+    cache = get_price_history_cache()
+    with cache["lock"]:
+        if cache["records"] is None or time.time() - cache["loaded_at"] > max_age:
+            cache["records"] = load_price_history()
+            cache["loaded_at"] = time.time()
+        return cache["records"]
+
 def load_products_from_supabase():
     """Load only the most recent snapshot of products from Supabase."""
     try:
-        # Step 1: Find the latest date in the Products table
-        latest_date_response = (
-            supabase.table(PRODUCTS_TABLE)
-            .select("Date")
-            .order("Date", desc=True)
-            .limit(1)
-            .execute()
-        )
-        if not latest_date_response.data:
-            return pd.DataFrame()
-
-        latest_date = latest_date_response.data[0]["Date"]
-
-        # Step 2: Fetch only records from that latest date
-        response = (
-            supabase.table(PRODUCTS_TABLE)
-            .select("*")
-            .eq("Date", latest_date)
-            .execute()
-        )
-        return pd.DataFrame(response.data)
+        with timed("load_products"):
+            # Step 1: Find the latest date in the Products table
+            latest_date_response = (
+                get_supabase().table(PRODUCTS_TABLE)
+                .select("Date")
+                .order("Date", desc=True)
+                .limit(1)
+                .execute()
+            )
+            _record_supabase_call(PRODUCTS_TABLE, "select", latest_date_response.data)
+            if not latest_date_response.data:
+                return pd.DataFrame()
+
+            latest_date = latest_date_response.data[0]["Date"]
+
+            # Step 2: Fetch only records from that latest date
+            response = (
+                get_supabase().table(PRODUCTS_TABLE)
+                .select("*")
+                .eq("Date", latest_date)
+                .execute()
+            )
+            _record_supabase_call(PRODUCTS_TABLE, "select", response.data)
+            return pd.DataFrame(response.data)
     except Exception as e:
+        record_error("supabase", e)
         return pd.DataFrame()
 
 # -------------------------------
@@ -89,11 +288,91 @@ def load_data(file_path):
     df = pd.read_csv(file_path)
     return df
 
+@st.cache_resource
+def get_product_store():
+    """Latest products shared across sessions, seeded from the local snapshot so the first paint needs no network."""
+    store = {"lock": threading.Lock(), "data": None, "loaded_at": 0.0, "failed_at": 0.0, "version": 0, "loading": None}
+    try:
+        with timed("snapshot.read"):
+            store["data"] = pd.read_pickle(SNAPSHOT_PATH)
+        if not set(VALUE_COLUMNS).issubset(store["data"].columns):
+            store["data"] = add_value_metrics(store["data"])  # Snapshot written before value analytics existed
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        record_error("snapshot", e)
+    return store
+
+def save_snapshot(data):
+    """Write the products to the local snapshot used for the next cold start."""
+    try:
+        with timed("snapshot.write"):
+            os.makedirs(os.path.dirname(SNAPSHOT_PATH), exist_ok=True)
+            data.to_pickle(SNAPSHOT_PATH + ".tmp")
+            os.replace(SNAPSHOT_PATH + ".tmp", SNAPSHOT_PATH)
+    except Exception as e:
+        record_error("snapshot", e)
+
+def _reload_products(store):
+    loaded = False
+    try:
+        data = load_products_from_supabase()
+        if data.empty:
+            return  # Nothing came back (errors are counted), keep serving what we have
+        with timed("analytics"):
+            data = add_value_metrics(data, get_price_history())
+        with store["lock"]:
+            store["data"] = data
+            store["loaded_at"] = time.time()
+            store["version"] += 1
+        loaded = True
+        save_snapshot(data)
+    except Exception as e:
+        record_error("products", e)
+    finally:
+        with store["lock"]:
+            if not loaded:
+                store["failed_at"] = time.time()  # Back off instead of retrying on every rerun
+            store["loading"] = None
+
+def get_products(max_age=PRODUCTS_MAX_AGE_SECONDS):
+    """
+    Return (products, version) from the shared store, starting a background reload from
+    Supabase once the data is older than max_age (and no sooner than PRODUCTS_RETRY_SECONDS
+    after a failed attempt). Only blocks when there is nothing to show yet.
+    """
+    store = get_product_store()
+    with store["lock"]:
+        now = time.time()
+        stale = now - store["loaded_at"] > max_age
+        if store["loading"] is None and stale and now - store["failed_at"] > PRODUCTS_RETRY_SECONDS:
+            store["loading"] = threading.Thread(target=_reload_products, args=(store,), daemon=True)
+            store["loading"].start()
+        loading = store["loading"]
+        waiting = store["data"] is None and loading is not None
+    if waiting:
+        with st.spinner("Loading products..."):
+            loading.join()
+    with store["lock"]:
+        data, version = store["data"], store["version"]
+    return (data if data is not None else pd.DataFrame()), version
+
+def products_loading():
+    return get_product_store()["loading"] is not None
+
+@st.fragment(run_every=2)
+def swap_in_fresh_products(version):
+    """Poll for a newer product version and rerun the app once one has been loaded."""
+    if get_product_store()["version"] != version:
+        st.rerun()
+
+@st.cache_resource
 def load_food_items():
     try:
         food_items = pd.read_csv('food_items.csv')
         return food_items
     except Exception as e:
+        record_error("food_items", e)
         return pd.DataFrame(columns=['Category', 'FoodItem'])  # Remove st.error message
 
 def sort_data(data, column):
@@ -108,6 +387,8 @@ def search_data(data, search_text):
         data = data[data['title'].str.contains(search_text, case=False, na=False)]
     return data
 
+SORT_OPTIONS = ['Sort by', '# of reviews', 'Rating', 'Top Viewed - Year', 'Top Viewed - Month', 'Top Seller - Year', 'Top Seller - Month', 'Best Deal', 'Price per Litre', 'Biggest Discount', 'Rating per Dollar']
+
 def sort_data_filter(data, sort_by):
     """Sort data based on the selected criteria, with IMDb-style weighted rating as the default."""
     if sort_by == '# of reviews':
@@ -122,6 +403,14 @@ def sort_data_filter(data, sort_by):
         data = data.sort_values(by='raw_sell_rank_yearly', ascending=True)
     elif sort_by == 'Top Seller - Month':
         data = data.sort_values(by='raw_sell_rank_monthly', ascending=True)
+    elif sort_by == 'Best Deal':
+        data = data.sort_values(by='deal_score', ascending=False)
+    elif sort_by == 'Price per Litre':
+        data = data.sort_values(by='price_per_litre', ascending=True)
+    elif sort_by == 'Biggest Discount':
+        data = data.sort_values(by='promo_discount_pct', ascending=False)
+    elif sort_by == 'Rating per Dollar':
+        data = data.sort_values(by='rating_per_dollar', ascending=False)
     else:
         # Default to IMDb-style weighted rating
         data = data.sort_values(by='weighted_rating', ascending=False)
@@ -133,14 +422,16 @@ def filter_and_sort_data(data, sort_by, **filters):
     search_text = filters.pop('search_text', '')
     filters.pop('store', None)  # Remove 'store' key if it exists
 
-    # Apply filters
-    data = filter_data(data, **filters)
+    with timed("filter"):
+        # Apply filters
+        data = filter_data(data, **filters)
 
-    # Apply search filter
-    data = search_data(data, search_text)
+        # Apply search filter
+        data = search_data(data, search_text)
 
     # Sort data
-    data = sort_data_filter(data, sort_by)
+    with timed("sort"):
+        data = sort_data_filter(data, sort_by)
     return data
 
 def filter_data(data, country='All Countries', region='All Regions', varietal='All Varietals', exclude_usa=False, in_stock=False, only_vintages=False):
@@ -151,9 +442,8 @@ def filter_data(data, country='All Countries', region='All Regions', varietal='A
     if varietal != 'All Varietals':
         data = data[data['raw_lcbo_varietal_name'] == varietal]
     if in_stock:
-        # Ensure 'stores_inventory' is numeric
-        data['stores_inventory'] = pd.to_numeric(data['stores_inventory'], errors='coerce')
-        data = data[data['stores_inventory'] > 0]
+        # Compare numerically without writing back, the products frame is shared between sessions
+        data = data[pd.to_numeric(data['stores_inventory'], errors='coerce') > 0]
     if only_vintages:
         data = data[data['raw_lcbo_program'].str.contains(r"['\"]Vintages['\"]", regex=True, na=False)]
     if exclude_usa:
@@ -215,6 +505,191 @@ def transform_image_url(url, new_size):
     # This regex finds a pattern like "digits.digits.ext" at the end of the URL
     return re.sub(r"\d+\.\d+\.(png|PNG)$", new_size, url)
 
+# -------------------------------
+# Image Cache
+# -------------------------------
+IMAGE_CACHE_DIR = os.environ.get("LCBO_IMAGE_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".image_cache"))
+IMAGE_CACHE_MAX_BYTES = 200 * 1024 * 1024  # Evict least recently used files beyond this
+IMAGE_VARIANTS = {  # LCBO rendition each variant is cut from (None = the thumbnail itself) and its longest edge in pixels
+    "thumb": (None, 300),  # 2x the 150px list width for high-DPI screens
+    "large": ("1280.1280.png", 1280),  # Only generated once someone opens the enlarged view
+}
+
+@st.cache_resource
+def get_image_cache():
+    """Lock, worker pool, in-flight downloads and observed LCBO image sizes for the on-disk image cache."""
+    os.makedirs(IMAGE_CACHE_DIR, exist_ok=True)
+    return {"lock": threading.Lock(), "pool": ThreadPoolExecutor(max_workers=4), "futures": {}, "remote_sizes": {}}
+
+def _image_cache_path(url, variant):
+    digest = hashlib.sha1(url.encode("utf-8")).hexdigest()
+    return os.path.join(IMAGE_CACHE_DIR, f"{digest}_{variant}.webp")
+
+def _image_source_url(url, variant):
+    """The LCBO URL a variant is generated from, which is also what the browser loads while it is uncached."""
+    source_size = IMAGE_VARIANTS[variant][0]
+    return transform_image_url(url, source_size) if source_size else url
+
+def _download_image(url):
+    response = requests.get(url, timeout=20)
+    response.raise_for_status()
+    increment("image_fetch_total")
+    increment("image_fetch_bytes_total", len(response.content))
+    return response.content
+
+def _generate_image_variant(url, variant):
+    """Download the LCBO rendition behind one variant and write it to the cache as resized WebP."""
+    source_url = _image_source_url(url, variant)
+    with timed("images.generate"):
+        try:
+            content = _download_image(source_url)
+        except Exception:
+            if source_url == url:
+                raise
+            # Not every product has a large rendition; fall back to the thumbnail itself
+            content = _download_image(url)
+        else:
+            get_image_cache()["remote_sizes"][source_url] = len(content)
+        image = Image.open(io.BytesIO(content))
+        image = image.convert("RGBA" if image.mode in ("RGBA", "LA", "P") else "RGB")
+        image.thumbnail((IMAGE_VARIANTS[variant][1],) * 2)
+        path = _image_cache_path(url, variant)
+        image.save(path + ".tmp", "WEBP", quality=80, method=4)
+        os.replace(path + ".tmp", path)
+    evict_image_cache()
+
+def evict_image_cache(max_bytes=IMAGE_CACHE_MAX_BYTES):
+    """Delete the least recently used cached images until the cache fits in max_bytes."""
+    cache = get_image_cache()
+    with cache["lock"]:
+        entries = []
+        for entry in os.scandir(IMAGE_CACHE_DIR):
+            if entry.name.endswith(".webp"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        if total <= max_bytes:
+            return
+        # Trim to 90% so we don't evict again on the very next write
+        for _, size, path in sorted(entries):
+            if total <= max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                increment("image_cache_evictions_total")
+            except OSError as e:
+                record_error("images", e)
+
+def _image_generation_done(cache, key, future):
+    cache["futures"].pop(key, None)
+    if future.exception() is not None:
+        record_error("images", future.exception())
+
+def prefetch_images(urls, variant="thumb"):
+    """Start downloading and resizing any uncached images of one variant without waiting for them."""
+    futures = {}
+    for url in urls:
+        if not isinstance(url, str) or url == 'N/A' or url in futures:
+            continue
+        if os.path.exists(_image_cache_path(url, variant)):
+            continue
+        cache = get_image_cache()
+        key = (url, variant)
+        with cache["lock"]:
+            future = cache["futures"].get(key)
+            if future is None:
+                future = cache["pool"].submit(_generate_image_variant, url, variant)
+                cache["futures"][key] = future
+                future.add_done_callback(lambda f, key=key: _image_generation_done(cache, key, f))
+        futures[url] = future
+    return futures
+
+def estimate_remote_image_bytes(source_url):
+    """Size of an LCBO image the browser loads itself: exact if we have fetched it, else the average seen so far."""
+    remote_sizes = get_image_cache()["remote_sizes"]
+    if source_url in remote_sizes:
+        return remote_sizes[source_url]
+    sizes = list(remote_sizes.values())
+    return sum(sizes) // len(sizes) if sizes else 0
+
+def get_cached_image(url, variant):
+    """
+    Return (image, bytes) for an image variant: WebP bytes from the cache, or on a miss the
+    LCBO URL for the browser to load itself (with its estimated size) while generation is queued.
+    """
+    path = _image_cache_path(url, variant)
+    if os.path.exists(path):
+        increment("image_cache_hits_total", variant=variant)
+        try:
+            os.utime(path)  # Mark as recently used for eviction
+            with open(path, "rb") as file:
+                data = file.read()
+            increment("image_bytes_served_total", len(data), variant=variant)
+            return data, len(data)
+        except OSError as e:
+            record_error("images", e)
+    else:
+        increment("image_cache_misses_total", variant=variant)
+        prefetch_images([url], variant)
+    source_url = _image_source_url(url, variant)
+    size = estimate_remote_image_bytes(source_url)
+    increment("image_bytes_remote_estimated_total", size, variant=variant)
+    return source_url, size
+
+@st.dialog("Enlarged Image", width="large")
+def show_enlarged_image(thumbnail_url, title):
+    """Only fetched when asked for, so the large rendition never loads with the product list."""
+    image, _ = get_cached_image(thumbnail_url, "large")
+    st.image(image, caption=title, use_column_width=True)
+
+# -------------------------------
+# Value Analytics
+# -------------------------------
+VALUE_COLUMNS = ['price_per_litre', 'promo_discount_pct', 'rating_per_dollar', 'price_percentile', 'deal_score']
+DEAL_SCORE_WEIGHTS = {'rating': 0.4, 'discount': 0.2, 'price_per_litre': 0.2, 'price_history': 0.2}
+MAX_DISCOUNT_PCT = 50  # Discounts at or beyond this get full marks in the deal score
+
+def _price_history_percentile(uris, prices, price_history):
+    """Share of each product's recorded prices that are below its current price, 0-100."""
+    if not price_history:
+        return pd.Series(float('nan'), index=uris.index, dtype='float64')
+    history = pd.DataFrame(price_history, columns=['URI', 'Price'])
+    history['Price'] = pd.to_numeric(history['Price'], errors='coerce')
+    current = pd.DataFrame({'URI': uris.values, 'current': prices.values}).dropna().drop_duplicates('URI')
+    merged = history.dropna().merge(current, on='URI')
+    below = (merged['Price'] < merged['current']).groupby(merged['URI']).mean() * 100
+    return uris.map(below).astype('float64')
+
+def add_value_metrics(df, price_history=None):
+    """
+    Add typed value columns for the whole catalogue at once: price per litre, promo discount %,
+    weighted rating per dollar, price history percentile (0 = cheapest seen) and a 0-100 deal score.
+    """
+    df = df.copy()
+    regular = pd.to_numeric(df['raw_ec_price'], errors='coerce')
+    promo = pd.to_numeric(df['raw_ec_promo_price'], errors='coerce')
+    price = promo.where(promo > 0, regular)
+    volume_ml = pd.to_numeric(df['raw_lcbo_unit_volume'].astype(str).str.extract(r'(\d+(?:\.\d+)?)')[0], errors='coerce')
+    bottles = pd.to_numeric(df['raw_lcbo_bottles_per_pack'], errors='coerce').fillna(1).clip(lower=1)
+    litres = volume_ml * bottles / 1000
+    rating = pd.to_numeric(df['weighted_rating'], errors='coerce')
+
+    df['price_per_litre'] = (price / litres.where(litres > 0)).astype('float64')
+    df['promo_discount_pct'] = ((regular - promo) / regular * 100).where(promo < regular, 0.0).fillna(0.0).clip(lower=0).astype('float64')
+    df['rating_per_dollar'] = (rating / price.where(price > 0)).astype('float64')
+    df['price_percentile'] = _price_history_percentile(df['uri'], price, price_history)
+
+    # Scale every component to 0..1 where higher is a better deal; missing data counts as average
+    components = pd.DataFrame({
+        'rating': rating.rank(pct=True),
+        'discount': (df['promo_discount_pct'] / MAX_DISCOUNT_PCT).clip(upper=1),
+        'price_per_litre': 1 - df['price_per_litre'].rank(pct=True),
+        'price_history': 1 - df['price_percentile'] / 100,
+    }).fillna(0.5)
+    df['deal_score'] = ((components * pd.Series(DEAL_SCORE_WEIGHTS)).sum(axis=1) * 100).astype('float64')
+    return df
+
 # -------------------------------
 # Refresh function
 # -------------------------------
@@ -222,7 +697,7 @@ def get_favourites_with_lowest_promo_price():
     """Check if favourites are at their lowest promo price."""
     favourites = supabase_get_records(FAVOURITES_TABLE)
     products = supabase_get_records(PRODUCTS_TABLE)
-    price_history = supabase_get_records("Price History")
+    price_history = supabase_get_records(PRICE_HISTORY_TABLE)
     
     lowest_price_items = []
     for fav in favourites:
@@ -260,8 +735,8 @@ def send_email_with_lowest_promo_prices(items):
     # Postmark SMTP configuration
     smtp_server = "smtp-broadcasts.postmarkapp.com"
     smtp_port = 587
-    smtp_username = SMTP_USER
-    smtp_password = SMTP_PASS
+    smtp_username = st.secrets["smtp"]["username"]
+    smtp_password = st.secrets["smtp"]["password"]
 
     # Email configuration
     sender_email = "winefind@justemail.ca"  # Replace with your sender email
@@ -287,8 +762,9 @@ def send_email_with_lowest_promo_prices(items):
             server.starttls()
             server.login(smtp_username, smtp_password)
             server.sendmail(sender_email, receiver_email, message.as_string())
+        increment("emails_sent_total")
     except Exception as e:
-        pass
+        record_error("smtp", e)
 
 def background_update(df_products, today_str):
     """Perform additional background tasks like checking favourites and sending emails."""
@@ -300,11 +776,6 @@ def refresh_data(store_id=None):
     """Refresh data and update Supabase."""
     current_time = datetime.now()
     today_str = current_time.strftime("%Y-%m-%d")
-    # Check if today's data already exists in Supabase
-    records = supabase_get_records(PRODUCTS_TABLE)
-   # if any(record.get("Date") == today_str for record in records):
-   #     return load_products_from_supabase()
-
     url = "https://platform.cloud.coveo.com/rest/search/v2?organizationId=lcboproduction2kwygmc"
     headers = {
         "User-Agent": "your_user_agent",
@@ -341,122 +812,135 @@ def refresh_data(store_id=None):
         }
         
     def get_items(payload):
-        response = requests.post(url, headers=headers, json=payload)
+        try:
+            response = requests.post(url, headers=headers, json=payload)
+        except Exception as e:
+            record_error("coveo", e)
+            raise
+        increment("coveo_requests_total")
+        increment("coveo_bytes_total", len(response.content))
         return response.json()
 
-    data = get_items(initial_payload)
+    with timed("refresh.fetch"):
+        data = get_items(initial_payload)
+        if 'results' in data:
+            all_items = data['results']
+            total_count = data['totalCount']
+            st.info(f"Loaded {total_count} items.")  # Keep this message
+            num_requests = (total_count // 500) + (1 if total_count % 500 != 0 else 0)
+            for i in range(1, num_requests):
+                payload = {
+                    "q": "",
+                    "tab": "clp-products-wine-red_wine",
+                    "sort": "ec_rating descending",
+                    "facets": [
+                        {
+                            "field": "ec_rating",
+                            "currentValues": [
+                                {
+                                    "value": "4..5inc",
+                                    "state": "selected"
+                                }
+                            ]
+                        }
+                    ],
+                    "numberOfResults": 500,
+                    "firstResult": i * 500,
+                    "aq": "@ec_visibility==(2,4) @cp_browsing_category_deny<>0 @ec_category==\"Products|Wine|Red Wine\" (@ec_rating==5..5 OR @ec_rating==4..4.9)"
+                }
+                if store_id:
+                   payload["dictionaryFieldContext"] = {
+                   "stores_stock": "",
+                   "stores_inventory": store_id,
+                   "stores_stock_combined": store_id,
+                   "stores_low_stock_combined": store_id
+                   }
+                data = get_items(payload)
+                if 'results' in data:
+                    all_items.extend(data['results'])
+                else:
+                    increment("errors_total", source="coveo")
+                    st.error(f"Key 'results' not found in the response during pagination. Response: {data}")
+                time.sleep(1)  # Avoid hitting the server too frequently
     if 'results' in data:
-        all_items = data['results']
-        total_count = data['totalCount']
-        st.info(f"Loaded {total_count} items.")  # Keep this message
-        num_requests = (total_count // 500) + (1 if total_count % 500 != 0 else 0)
-        for i in range(1, num_requests):
-            payload = {
-                "q": "",
-                "tab": "clp-products-wine-red_wine",
-                "sort": "ec_rating descending",
-                "facets": [
-                    {
-                        "field": "ec_rating",
-                        "currentValues": [
-                            {
-                                "value": "4..5inc",
-                                "state": "selected"
-                            }
-                        ]
-                    }
-                ],
-                "numberOfResults": 500,
-                "firstResult": i * 500,
-                "aq": "@ec_visibility==(2,4) @cp_browsing_category_deny<>0 @ec_category==\"Products|Wine|Red Wine\" (@ec_rating==5..5 OR @ec_rating==4..4.9)"
-            }
-            if store_id:
-               payload["dictionaryFieldContext"] = {
-               "stores_stock": "",
-               "stores_inventory": store_id,
-               "stores_stock_combined": store_id,
-               "stores_low_stock_combined": store_id
-               }
-            data = get_items(payload)
-            if 'results' in data:
-                all_items.extend(data['results'])
-            else:
-                st.error(f"Key 'results' not found in the response during pagination. Response: {data}")
-            time.sleep(1)  # Avoid hitting the server too frequently
+        increment("coveo_rows_total", len(all_items))
 
-        
-        products = []
-        for product in all_items:
-            raw_data = product['raw']
+        with timed("refresh.transform"):
+            products = []
+            for product in all_items:
+                raw_data = product['raw']
             
-            product_info = {
-                'title': product.get('title', 'N/A'),
-                'uri': product.get('uri', 'N/A'),
-                'raw_ec_thumbnails': raw_data.get('ec_thumbnails', 'N/A'),
-                'raw_ec_shortdesc': raw_data.get('ec_shortdesc', 'N/A'),
-                'raw_lcbo_tastingnotes': raw_data.get('lcbo_tastingnotes', 'N/A'),
-                'raw_lcbo_region_name': raw_data.get('lcbo_region_name', 'N/A'),
-                'raw_country_of_manufacture': raw_data.get('country_of_manufacture', 'N/A'),
-                'raw_lcbo_program': raw_data.get('lcbo_program', 'N/A'),
-                'raw_created_at': raw_data.get('created_at', 'N/A'),
-                'raw_is_buyable': raw_data.get('is_buyable', 'N/A'),
-                'raw_ec_price': raw_data.get('ec_price', 'N/A'),
-                'raw_ec_final_price': raw_data.get('ec_final_price', 'N/A'),
-                'raw_ec_promo_price': raw_data.get('ec_promo_price', 'N/A'),
-                'raw_lcbo_unit_volume': raw_data.get('lcbo_unit_volume', 'N/A'),
-                'raw_lcbo_alcohol_percent': raw_data.get('lcbo_alcohol_percent', 'N/A'),
-                'raw_lcbo_sugar_gm_per_ltr': raw_data.get('lcbo_sugar_gm_per_ltr', 'N/A'),
-                'raw_lcbo_bottles_per_pack': raw_data.get('lcbo_bottles_per_pack', 'N/A'),
-                'raw_sysconcepts': raw_data.get('sysconcepts', 'N/A'),
-                'raw_ec_category': raw_data.get('ec_category', 'N/A'),
-                'raw_ec_category_filter': raw_data.get('ec_category_filter', 'N/A'),
-                'raw_lcbo_varietal_name': raw_data.get('lcbo_varietal_name', 'N/A'),
-                'raw_stores_stock': raw_data.get('stores_stock', 'N/A'),
-                'raw_stores_stock_combined': raw_data.get('stores_stock_combined', 'N/A'),
-                'raw_stores_low_stock_combined': raw_data.get('stores_low_stock_combined', 'N/A'),
-                'raw_stores_low_stock': raw_data.get('stores_low_stock', 'N/A'),
-                'raw_out_of_stock': raw_data.get('out_of_stock', 'N/A'),
-                'stores_inventory': raw_data.get('stores_inventory', 0),
-                'raw_online_inventory': raw_data.get('online_inventory', 0),
-                'raw_avg_reviews': raw_data.get('avg_reviews', 0),
-                'raw_ec_rating': raw_data.get('ec_rating', 0),
-                'weighted_rating': 0.0,  # Placeholder for weighted rating
-                'raw_view_rank_yearly': raw_data.get('view_rank_yearly', 'N/A'),
-                'raw_view_rank_monthly': raw_data.get('view_rank_monthly', 'N/A'),
-                'raw_sell_rank_yearly': raw_data.get('sell_rank_yearly', 'N/A'),
-                'raw_sell_rank_monthly': raw_data.get('sell_rank_monthly', 'N/A')
-            }
-            products.append(product_info)
-
-        # Create a temporary DataFrame for immediate display
-        df_products = pd.DataFrame(products)
-        # Calculate mean rating for products with reviews
-        valid_reviews = pd.to_numeric(df_products['raw_avg_reviews'], errors='coerce')
-        valid_ratings = pd.to_numeric(df_products['raw_ec_rating'], errors='coerce')
-        mean_rating = valid_ratings[valid_reviews > 0].mean()
-        minimum_votes = 10  # Minimum number of votes required
+                product_info = {
+                    'title': product.get('title', 'N/A'),
+                    'uri': product.get('uri', 'N/A'),
+                    'raw_ec_thumbnails': raw_data.get('ec_thumbnails', 'N/A'),
+                    'raw_ec_shortdesc': raw_data.get('ec_shortdesc', 'N/A'),
+                    'raw_lcbo_tastingnotes': raw_data.get('lcbo_tastingnotes', 'N/A'),
+                    'raw_lcbo_region_name': raw_data.get('lcbo_region_name', 'N/A'),
+                    'raw_country_of_manufacture': raw_data.get('country_of_manufacture', 'N/A'),
+                    'raw_lcbo_program': raw_data.get('lcbo_program', 'N/A'),
+                    'raw_created_at': raw_data.get('created_at', 'N/A'),
+                    'raw_is_buyable': raw_data.get('is_buyable', 'N/A'),
+                    'raw_ec_price': raw_data.get('ec_price', 'N/A'),
+                    'raw_ec_final_price': raw_data.get('ec_final_price', 'N/A'),
+                    'raw_ec_promo_price': raw_data.get('ec_promo_price', 'N/A'),
+                    'raw_lcbo_unit_volume': raw_data.get('lcbo_unit_volume', 'N/A'),
+                    'raw_lcbo_alcohol_percent': raw_data.get('lcbo_alcohol_percent', 'N/A'),
+                    'raw_lcbo_sugar_gm_per_ltr': raw_data.get('lcbo_sugar_gm_per_ltr', 'N/A'),
+                    'raw_lcbo_bottles_per_pack': raw_data.get('lcbo_bottles_per_pack', 'N/A'),
+                    'raw_sysconcepts': raw_data.get('sysconcepts', 'N/A'),
+                    'raw_ec_category': raw_data.get('ec_category', 'N/A'),
+                    'raw_ec_category_filter': raw_data.get('ec_category_filter', 'N/A'),
+                    'raw_lcbo_varietal_name': raw_data.get('lcbo_varietal_name', 'N/A'),
+                    'raw_stores_stock': raw_data.get('stores_stock', 'N/A'),
+                    'raw_stores_stock_combined': raw_data.get('stores_stock_combined', 'N/A'),
+                    'raw_stores_low_stock_combined': raw_data.get('stores_low_stock_combined', 'N/A'),
+                    'raw_stores_low_stock': raw_data.get('stores_low_stock', 'N/A'),
+                    'raw_out_of_stock': raw_data.get('out_of_stock', 'N/A'),
+                    'stores_inventory': raw_data.get('stores_inventory', 0),
+                    'raw_online_inventory': raw_data.get('online_inventory', 0),
+                    'raw_avg_reviews': raw_data.get('avg_reviews', 0),
+                    'raw_ec_rating': raw_data.get('ec_rating', 0),
+                    'weighted_rating': 0.0,  # Placeholder for weighted rating
+                    'raw_view_rank_yearly': raw_data.get('view_rank_yearly', 'N/A'),
+                    'raw_view_rank_monthly': raw_data.get('view_rank_monthly', 'N/A'),
+                    'raw_sell_rank_yearly': raw_data.get('sell_rank_yearly', 'N/A'),
+                    'raw_sell_rank_monthly': raw_data.get('sell_rank_monthly', 'N/A')
+                }
+                products.append(product_info)
+
+            # Create a temporary DataFrame for immediate display
+            df_products = pd.DataFrame(products)
+            # Calculate mean rating for products with reviews
+            valid_reviews = pd.to_numeric(df_products['raw_avg_reviews'], errors='coerce')
+            valid_ratings = pd.to_numeric(df_products['raw_ec_rating'], errors='coerce')
+            mean_rating = valid_ratings[valid_reviews > 0].mean()
+            minimum_votes = 10  # Minimum number of votes required
         
-        def weighted_rating(R, v, m, C):
-            # Calculate IMDb-style weighted rating
-            return (v / (v + m)) * R + (m / (v + m)) * C
-
-        # Compute weighted rating using numeric conversion
-        # Compute weighted rating using numeric conversion
-        def safe_float(val):
-            try:
-                return float(val)
-            except (ValueError, TypeError):
-                return 0.0
-
-        df_products['weighted_rating'] = df_products.apply(
-            lambda x: weighted_rating(
-                 safe_float(x['raw_ec_rating']) if safe_float(x['raw_avg_reviews']) > 0 else 0,
-                 safe_float(x['raw_avg_reviews']),
-                 minimum_votes,
-                 mean_rating if not pd.isna(mean_rating) else 0
-            ),
-            axis=1
-         )
+            def weighted_rating(R, v, m, C):
+                # Calculate IMDb-style weighted rating
+                return (v / (v + m)) * R + (m / (v + m)) * C
+
+            # Compute weighted rating using numeric conversion
+            # Compute weighted rating using numeric conversion
+            def safe_float(val):
+                try:
+                    return float(val)
+                except (ValueError, TypeError):
+                    return 0.0
+
+            df_products['weighted_rating'] = df_products.apply(
+                lambda x: weighted_rating(
+                     safe_float(x['raw_ec_rating']) if safe_float(x['raw_avg_reviews']) > 0 else 0,
+                     safe_float(x['raw_avg_reviews']),
+                     minimum_votes,
+                     mean_rating if not pd.isna(mean_rating) else 0
+                ),
+                axis=1
+             )
+
+        with timed("refresh.analytics"):
+            df_products = add_value_metrics(df_products, get_price_history())
 
         
         
@@ -474,27 +958,29 @@ def refresh_data(store_id=None):
         # Start background thread for updates
         def update_supabase():
             """Update the Products and Price History tables in Supabase."""
-            for _, product in df_products.iterrows():
-                product_data = product.to_dict()
-                product_data["Date"] = today_str  # Add today's date
-
-                # Update the Products table
-                supabase_upsert_record(PRODUCTS_TABLE, product_data)
-
-                # Determine the price to store in the Price History table
-                price = product_data.get("raw_ec_promo_price", "N/A")
-                if price == "N/A":
-                    price = product_data.get("raw_ec_price", "N/A")
-
-                # Update the Price History table if a valid price exists
-                if price != "N/A":
-                    price_history_data = {
-                        "URI": product_data.get("uri", "N/A"),
-                        "Title": product_data.get("title", "Unknown"),
-                        "Date": today_str,
-                        "Price": price
-                    }
-                    supabase_upsert_record("Price History", price_history_data)
+            with timed("refresh.persist"):
+                for _, product in df_products.iterrows():
+                    # Value columns are derived, they are recomputed on load instead of stored in Supabase
+                    product_data = product.drop(labels=VALUE_COLUMNS, errors='ignore').to_dict()
+                    product_data["Date"] = today_str  # Add today's date
+
+                    # Update the Products table
+                    supabase_upsert_record(PRODUCTS_TABLE, product_data)
+
+                    # Determine the price to store in the Price History table
+                    price = product_data.get("raw_ec_promo_price", "N/A")
+                    if price == "N/A":
+                        price = product_data.get("raw_ec_price", "N/A")
+
+                    # Update the Price History table if a valid price exists
+                    if price != "N/A":
+                        price_history_data = {
+                            "URI": product_data.get("uri", "N/A"),
+                            "Title": product_data.get("title", "Unknown"),
+                            "Date": today_str,
+                            "Price": price
+                        }
+                        supabase_upsert_record(PRICE_HISTORY_TABLE, price_history_data)
 
         # Start a thread to update Supabase in the background
         threading.Thread(target=update_supabase, daemon=True).start()
@@ -505,26 +991,41 @@ def refresh_data(store_id=None):
         st.success("Data loaded! Background updates are in progress.")  # Keep this message
         return df_products
     else:
+        increment("errors_total", source="coveo")
         return None  # Remove st.error message
 
 # -------------------------------
 # Main Streamlit App
 # -------------------------------
+@st.cache_resource
+def load_country_codes():
+    with open("country_codes.json", "r") as file:
+        return json.load(file)
+
+@st.cache_resource
+def _flag_data_uri(country_code):
+    with open(os.path.join("SVG", f"{country_code}.svg"), "rb") as file:
+        return "data:image/svg+xml;base64," + base64.b64encode(file.read()).decode("ascii")
+
 def get_country_flag_url(country_name):
     """
-    Load country-to-code mapping from JSON and return the local flag SVG path.
+    Return the bundled flag SVG for a country as a data URI, so no request leaves the page.
     """
     try:
-        with open("country_codes.json", "r") as file:
-            country_to_code = json.load(file)
-        country_code = country_to_code.get(country_name)
+        country_code = load_country_codes().get(country_name)
         if country_code:
-            return f"https://raw.githubusercontent.com/wineguy-maker/lcbo/760b3b0e07f331dd4cf2a42a0bc1149cf0f73154/SVG/{country_code}.svg"  # Use the local SVG folder
+            flag_url = _flag_data_uri(country_code)
+            increment("image_bytes_served_total", len(flag_url), variant="flag")
+            return flag_url
     except Exception as e:
+        record_error("country_codes", e)
         st.error(f"Error loading country codes: {e}")
     return None
 
 def main():
+    startup = get_startup(IMPORT_STARTED_AT)
+    if "session_started_at" not in st.session_state:
+        st.session_state.session_started_at = time.perf_counter()
     st.title("🍷 LCBO Wine Filter")
     # Add this line to clear the cached data
     st.cache_data.clear()
@@ -546,8 +1047,9 @@ def main():
                 st.sidebar.error("Incorrect PIN. Please try again.")
 
     # Initialize session state for favourites and UI updates
-    if "favourites" not in st.session_state:
-        st.session_state.favourites = load_favourites()
+    # Favourites load in the background and are only waited on right before the product list
+    if "favourites" not in st.session_state and "favourites_future" not in st.session_state:
+        st.session_state.favourites_future = get_executor().submit(load_favourites)
     if "ui_updated" not in st.session_state:
         st.session_state.ui_updated = False
 
@@ -571,14 +1073,20 @@ def main():
         st.session_state.selected_store = selected_store
         if selected_store != 'Select Store':
             store_id = store_ids.get(selected_store)
-            data = refresh_data(store_id=store_id)
+            st.session_state.store_data = refresh_data(store_id=store_id)
         else:
-            data = load_products_from_supabase()
+            st.session_state.pop('store_data', None)
+
+    # A selected store keeps its own frame (with that store's inventory) for the whole session;
+    # only 'Select Store' uses the shared catalogue
+    products_version = None
+    if selected_store != 'Select Store' and st.session_state.get('store_data') is not None:
+        data = st.session_state.store_data
     else:
-        data = load_products_from_supabase()
+        data, products_version = get_products()
 
     search_text = st.sidebar.text_input("Search", value="")
-    sort_by = st.sidebar.selectbox("Sort by", ['Sort by', '# of reviews', 'Rating', 'Top Viewed - Year', 'Top Viewed - Month', 'Top Seller - Year', 'Top Seller - Month'])
+    sort_by = st.sidebar.selectbox("Sort by", SORT_OPTIONS)
 
     # Create filter options from data
     food_items = load_food_items()
@@ -599,6 +1107,13 @@ def main():
     only_favourites = st.sidebar.checkbox("Only Favourites", value=False)
 
     # Load favourites from session state
+    if "favourites" not in st.session_state:
+        try:
+            st.session_state.favourites = st.session_state.favourites_future.result()
+        except Exception as e:
+            record_error("supabase", e)
+            st.session_state.favourites = []
+        del st.session_state.favourites_future
     favourites = st.session_state.favourites
    
     # Apply Filters and Sorting
@@ -636,7 +1151,20 @@ def main():
     end_idx = start_idx + page_size
     page_data = filtered_data.iloc[start_idx:end_idx]
 
+    # Warm the thumbnail cache for this page and the next in the background; uncached ones render from LCBO meanwhile
+    prefetch_images(filtered_data.iloc[start_idx:end_idx + page_size]['raw_ec_thumbnails'].tolist())
+    with timed("images.page"):
+        page_images = {}
+        for url in page_data['raw_ec_thumbnails']:
+            if pd.notna(url) and url != 'N/A' and url not in page_images:
+                page_images[url] = get_cached_image(url, "thumb")
+    # Bytes the browser receives for this page's thumbnails: ours from the cache, LCBO's (estimated) on a miss
+    for image, size in page_images.values():
+        increment("page_image_bytes_total", size, source="cache" if isinstance(image, bytes) else "lcbo")
+    increment("page_views_total")
+
     # Display Products
+    render_start = time.perf_counter()
     for idx, row in page_data.iterrows():
         # Get the flag URL
         country_name = row.get('raw_country_of_manufacture', 'N/A')
@@ -713,11 +1241,10 @@ def main():
         # Display the thumbnail image
         thumbnail_url = row.get('raw_ec_thumbnails', None)
         if pd.notna(thumbnail_url) and thumbnail_url != 'N/A':
-            st.image(thumbnail_url, width=150)
-            # Add an "Enlarge Image" button below the thumbnail.
-            with st.popover("Enlarge Image"):
-                large_image_url = transform_image_url(thumbnail_url, "2048.2048.png")
-                st.image(large_image_url, width=True)
+            st.image(page_images[thumbnail_url][0], width=150)
+            # Add an "Enlarge Image" button below the thumbnail; the large image is only fetched once it is clicked.
+            if st.button("Enlarge Image", key=f"enlarge-{wine_id}"):
+                show_enlarged_image(thumbnail_url, row['title'])
         else:
             st.write("No image available.")
 
@@ -726,8 +1253,7 @@ def main():
             # Here, just inline the same content you used to show in show_detailed_product_popup()
             st.write("### Detailed Product View")
             if pd.notna(thumbnail_url) and thumbnail_url != 'N/A':
-                detail_image_url = transform_image_url(thumbnail_url, "1280.1280.png")
-                st.image(detail_image_url, width=300)
+                st.image(page_images[thumbnail_url][0], width=300)
             if pd.notna(row['raw_lcbo_program']) and row['raw_lcbo_program'] != 'N/A': 
                 st.markdown(f"**Vintage**")
             st.markdown(f"**Title:** {row['title']}")
@@ -747,7 +1273,32 @@ def main():
             st.markdown(f"**Yearly View Rank:** {row['raw_view_rank_yearly']}")
             st.markdown(f"**Alcohol %:** {row['raw_lcbo_alcohol_percent']}")
             st.markdown(f"**Sugar (p/ltr):** {row['raw_lcbo_sugar_gm_per_ltr']}")
+            if pd.notna(row.get('price_per_litre')):
+                st.markdown(f"**Price per Litre:** ${row['price_per_litre']:.2f}")
+            if pd.notna(row.get('deal_score')):
+                st.markdown(f"**Deal Score:** {row['deal_score']:.0f}/100")
             st.markdown("---")
+    record_span("render", time.perf_counter() - render_start)
+
+    # Time to first render, once per process and once per session
+    if startup["first_render"] is None:
+        startup["first_render"] = time.perf_counter() - startup["started_at"]
+        record_span("cold_start.first_render", startup["first_render"])
+    if not st.session_state.get("first_render_recorded"):
+        st.session_state.first_render_recorded = True
+        record_span("session.first_render", time.perf_counter() - st.session_state.session_started_at)
+
+    # Swap in fresh products: straight away if the reload already landed while this page was drawn,
+    # otherwise poll for it while it is still in flight
+    if products_version is not None:
+        if get_product_store()["version"] != products_version:
+            st.rerun()
+        elif products_loading():
+            swap_in_fresh_products(products_version)
+
+    # Show timings to admins once everything above has been measured
+    if st.session_state.authorized:
+        show_metrics_panel()
 
     # Reset the UI update flag
     st.session_state.ui_updated = False